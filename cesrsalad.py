@@ -3,6 +3,7 @@
 import os
 import sys
 import argparse
+import functools
 from oauth2client.service_account import ServiceAccountCredentials
 try:
     import gspread
@@ -25,20 +26,30 @@ except:
 
 import similarity
 import utils
-from collections import defaultdict, OrderedDict
+from collections import defaultdict
 import traceback
 import pprint
 import datetime
+import glob
+import gzip
+import pickle
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 CLIENT_CREDENTIALS = "~/.google/sdg_id.json"
-GOOGLE_CREDENTIALS = None
+CACHE_DIR = "~/.cache/sdg"
+# "Indicator QA Status" values that mark an indicator as already reviewed
+QA_REVIEWED_STATUS = frozenset(['Complete', 'Needs Review'])
 
 
-def initialize_google():
-    """Initialize Google API using client credentials
+@functools.lru_cache(maxsize=1)
+def google_client():
+    """Return Google API client authorized with client credentials
        Store client oauth json credentials file in
        CLIENT_CREDENTIALS folder
        To setup oauth: http://gspread.readthedocs.io/en/latest/oauth2.html
+       Authorization happens on first call only, later calls reuse the client
     """
 
     # Validate credentials client file
@@ -48,8 +59,7 @@ def initialize_google():
                   'https://www.googleapis.com/auth/drive']
 
         cred =  ServiceAccountCredentials.from_json_keyfile_name(client_cred_file, scope)
-        global GOOGLE_CREDENTIALS
-        GOOGLE_CREDENTIALS = gspread.authorize(cred)
+        return gspread.authorize(cred)
 
     else:
         raise Exception("Please create Google OAUTH client and copy it in '{}'".format(CLIENT_CREDENTIALS))
@@ -58,15 +68,27 @@ def initialize_google():
 def open_spreadsheet(spreadsheet_name):
     """Open spreadsheet by name and return"""
 
-    global GOOGLE_CREDENTIALS
-    return GOOGLE_CREDENTIALS.open(spreadsheet_name)
+    return google_client().open(spreadsheet_name)
 
 
 def validate(worksheets, args, report, ignore_title_count):
     """Perform various cross validations on worksheets
         in a spreadsheet and generate output a report"""
 
-    def validate_bia_sdg_mapping_sheet(wks, reportsheet_dict, title_count, wks_target_mapping):
+    # Formats shared by all report worksheets
+    bold = report.add_format({'bold': True})
+    bg_green = report.add_format({'bold': True, 'bg_color': "#c5eac6"})
+    bg_red = report.add_format({'bold': True, 'bg_color': "#efc6c6"})
+
+    def new_report_sheet(sheetname, title, title_format=None):
+        """Add a report worksheet with title in its first row and
+           return a writer positioned after the title rows
+        """
+        rwks = report.add_worksheet(sheetname)
+        rwks.write(0, 0, title, title_format)
+        return utils.ReportWriter(rwks, bold, bg_green, bg_red)
+
+    def validate_bia_sdg_mapping_sheet(wks, title_count, wks_target_mapping):
         """Performs validation on 'BIA to SDG mapping' sheet
            Validates that we have identical DirectTargets and IndirectTargets
            for rows with same Concept Code.
@@ -79,101 +101,72 @@ def validate(worksheets, args, report, ignore_title_count):
               building graph mapping
         """
 
-        def validate_target_format(colnumber, coltitle, rd, title_count):
+        def validate_target_format(colnumber, target_lists, coltitle, rw, title_count):
             """Helper function to validate the syntax of a target specified in
                Direct or Indirect Target column
                The format should be like digit.digit or digit.alpha
             """
 
-            mismatches = utils.validate_target_format(wks, colnumber)
+            mismatches = utils.validate_target_format(wks, colnumber, target_lists)
 
             if len(mismatches) == 0:
                 print("\n Test invalid syntax for {} Targets: Passed. Good Job!".format(coltitle))
-                rd["sheet"].write(rd["row"], 0, "Test invalid syntax for {} Targets".format(coltitle))
-                rd["sheet"].write(rd["row"], 1, "Passed. Good Job!", rd["green"])
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
+                rw.status("Test invalid syntax for {} Targets".format(coltitle), True)
+                rw.blank()
             else:
                 print("\n Test invalid syntax for {} Targets: Failed".format(coltitle))
-                rd["sheet"].write(rd["row"], 0, "Test invalid syntax for {} Targets".format(coltitle))
-                rd["sheet"].write(rd["row"], 1, "Failed", rd["red"])
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
+                rw.status("Test invalid syntax for {} Targets".format(coltitle), False)
+                rw.blank()
 
                 table = PrettyTable(["Row Number", "Invalid Syntax {} Targets".format(coltitle)])
                 table.border = True
-                rd["sheet"].write_row(rd["row"], 0, tuple(["Row Number", "Invalid Syntax {} Targets".format(coltitle)]), rd["bold"])
-                rd["row"]+=1
-
-                for x in mismatches:
-                    # Fix Row count by adding number of rows used for title
-                    table.add_row([x+title_count, ",".join("'{}'".format(str(y)) for y in mismatches[x])])
-                    rd["sheet"].write_row(rd["row"], 0, tuple([x+title_count, ",".join("'{}'".format(str(y)) for y in mismatches[x])]))
-                    rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
+                rw.header(["Row Number", "Invalid Syntax {} Targets".format(coltitle)])
+
+                # Fix Row count by adding number of rows used for title
+                rows = [[x+title_count, ",".join("'{}'".format(str(y)) for y in mismatches[x])] for x in mismatches]
+                table.add_rows(rows)
+                rw.add_rows(rows)
+                rw.blank(2)
                 print(table)
 
-        def crossvalidate_with_concept_code(colnumber, coltitle, rd, title_count):
+        def crossvalidate_with_concept_code(target_lists, coltitle, rw, title_count):
             """Helper function for validate_bia_sdg_mapping_sheet
                Common code to validate either DirectTarget or IndirectTarget
             """
 
-            concepts_dict = {}
-            mismatches = defaultdict(list)
-
-            for n,x in enumerate(wks):
-                # Ignore first two lines since they contain titles
-                target_list = utils.get_target_list(wks,n, colnumber)
-                concept_code = x[0]
-                if concept_code in concepts_dict:
-                    if concepts_dict[concept_code][0] != target_list:
-                        if concept_code not in mismatches:
-                            if concepts_dict[concept_code] not in mismatches[concept_code]:
-                                mismatches[concept_code].append(concepts_dict[concept_code])
-                            mismatches[concept_code].append([target_list, n+1])
-                else:
-                    concepts_dict[concept_code] = [target_list, n+1]
+            # Concept Code -> [sorted target list, row] for every row with that code
+            groups = defaultdict(list)
+            for n, (x, target_list) in enumerate(zip(wks, target_lists)):
+                groups[x[0]].append([sorted(target_list), n+1])
+
+            # Report all rows of a Concept Code whose rows disagree on targets
+            mismatches = {code: items for code, items in groups.items()
+                          if len({tuple(t) for t, _ in items}) > 1}
 
             if len(mismatches) == 0:
                 print("\n Test for mismatched {} Targets found (for same ConceptCode): Passed. Good Job!".format(coltitle))
-                rd["sheet"].write(rd["row"], 0, "Test for mismatched {} Targets found (for same ConceptCode)".format(coltitle))
-                rd["sheet"].write(rd["row"], 1, "Passed. Good Job!", rd["green"])
-                rd["row"]+=1
+                rw.status("Test for mismatched {} Targets found (for same ConceptCode)".format(coltitle), True)
 
             else:
                 print("\n Test for mismatched {} Target text found (for same ConceptCode): Failed".format(coltitle))
                 table = PrettyTable(["Concept Code", "Mismatched {} Targets".format(coltitle), "Mismatched Row Number"])
                 table.border = True
-                rd["sheet"].write(rd["row"], 0, "Test for mismatched {} Targets found (for same ConceptCode)".format(coltitle))
-                rd["sheet"].write(rd["row"], 1, "Failed", rd["red"])
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
-                rd["sheet"].write_row(rd["row"], 0, tuple(["Concept Code", "Mismatched {} Targets".format(coltitle), "Mismatched Row Number"]), rd["bold"])
-                rd["row"]+=1
-
-                for x in mismatches:
-                    for items in mismatches[x]:
-                        # Fix row count by adding number of rows used for title
-                        items[1]+=title_count
-                        table.add_row([x, ",".join((str(y) for y in items[0])), items[1]])
-                        rd["sheet"].write_row(rd["row"], 0, tuple([x, ",".join((str(y) for y in items[0])), items[1]]))
-                        rd["row"]+=1
+                rw.status("Test for mismatched {} Targets found (for same ConceptCode)".format(coltitle), False)
+                rw.blank()
+                rw.header(["Concept Code", "Mismatched {} Targets".format(coltitle), "Mismatched Row Number"])
+
+                # Fix row count by adding number of rows used for title
+                rows = [[x, ",".join((str(y) for y in items[0])), items[1]+title_count]
+                        for x in mismatches for items in mismatches[x]]
+                table.add_rows(rows)
+                rw.add_rows(rows)
                 print(table)
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
+                rw.blank(2)
 
-        def missing_concept_code_from_target_sheet(rd):
+        def missing_concept_code_from_target_sheet(rw):
 
-            concept_code = set(utils.get_column(wks, 0))
-            concept_code_from_target_sheet = set(utils.get_column(wks_target_mapping, 0))
+            concept_code = utils.get_column_set(wks, 0)
+            concept_code_from_target_sheet = utils.get_column_set(wks_target_mapping, 0)
 
             missing_in_sheet_1 = concept_code_from_target_sheet - concept_code
             missing_in_sheet_2 = concept_code - concept_code_from_target_sheet
@@ -181,188 +174,127 @@ def validate(worksheets, args, report, ignore_title_count):
 
             if len(missing_in_sheet_1)  ==  0:
                 print("\n Test for Concept Code missing from 'BIA to SDG Target Mapping' worksheet: Passed. Good Job!")
-                rd["sheet"].write(rd["row"], 0, "Test for Concept Code missing from 'BIA to SDG Target Mapping' worksheet")
-                rd["sheet"].write(rd["row"], 1, "Passed. Good Job!", rd["green"])
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
+                rw.status("Test for Concept Code missing from 'BIA to SDG Target Mapping' worksheet", True)
+                rw.blank()
             else:
                 print("\nTest for Concept Code missing from 'BIA to SDG Target Mapping' worksheet: Failed")
-                rd["sheet"].write(rd["row"], 0, "Test for Concept Code missing from 'BIA to SDG Target Mapping' worksheet")
-                rd["sheet"].write(rd["row"], 1, "Failed", rd["red"])
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
+                rw.status("Test for Concept Code missing from 'BIA to SDG Target Mapping' worksheet", False)
+                rw.blank()
 
                 table = PrettyTable(["Concept Codes"])
                 table.border = True
-                rd["sheet"].write_row(rd["row"], 0, tuple(["Concept Code"]), rd["bold"])
-                rd["row"]+=1
-
-                for x in missing_in_sheet_1:
-                    # Fix Row count by adding number of rows used for title
-                    table.add_row([x])
-                    rd["sheet"].write_row(rd["row"], 0, tuple([x]))
-                    rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
+                rw.header(["Concept Code"])
+
+                rows = [[x] for x in missing_in_sheet_1]
+                table.add_rows(rows)
+                rw.add_rows(rows)
+                rw.blank(2)
                 print(table)
 
 
             if len(missing_in_sheet_2)  ==  0:
                 print("\n Test for Concept Code from this sheet but missing in 'BIA to SDG Target Mapping' worksheet: Passed. Good Job!")
-                rd["sheet"].write(rd["row"], 0, "Test for Concept Code from this sheet but missing in 'BIA to SDG Target Mapping' worksheet")
-                rd["sheet"].write(rd["row"], 1, "Passed. Good Job!", rd["green"])
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
+                rw.status("Test for Concept Code from this sheet but missing in 'BIA to SDG Target Mapping' worksheet", True)
+                rw.blank()
             else:
                 print("\nTest for Concept Code from this sheet but missing in 'BIA to SDG Target Mapping' worksheet: Failed")
-                rd["sheet"].write(rd["row"], 0, "Test for Concept Code from this sheet but missing in 'BIA to SDG Target Mapping' worksheet")
-                rd["sheet"].write(rd["row"], 1, "Failed", rd["red"])
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
+                rw.status("Test for Concept Code from this sheet but missing in 'BIA to SDG Target Mapping' worksheet", False)
+                rw.blank()
 
                 table = PrettyTable(["Concept Codes"])
                 table.border = True
-                rd["sheet"].write_row(rd["row"], 0, tuple(["Concept Code"]), rd["bold"])
-                rd["row"]+=1
-
-                for x in missing_in_sheet_2:
-                    # Fix Row count by adding number of rows used for title
-                    table.add_row([x])
-                    rd["sheet"].write_row(rd["row"], 0, tuple([x]))
-                    rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
+                rw.header(["Concept Code"])
+
+                rows = [[x] for x in missing_in_sheet_2]
+                table.add_rows(rows)
+                rw.add_rows(rows)
+                rw.blank(2)
                 print(table)
 
 
         # Create Validation Report Worksheet
-        rwks = report.add_worksheet("BIA to SDG mapping")
-        bold = report.add_format({'bold': True})
-        bg_green = report.add_format({'bold': True, 'bg_color': "#c5eac6"})
-        bg_red = report.add_format({'bold': True, 'bg_color': "#efc6c6"})
-        report_dict = {"sheet": rwks, "row": 3, "bold": bold, "green": bg_green, "red": bg_red}
-        report_dict["sheet"].write(0, 0, "Test Status")
-        report_dict["sheet"].write(1, 0, None)
-        report_dict["sheet"].write(2, 0, None)
+        report_writer = new_report_sheet("BIA to SDG mapping", "Test Status")
+
+        # Parse target cells once per column, shared by the checks below
+        direct_targets = [utils.build_target_list(row[33]) for row in wks]
+        indirect_targets = [utils.build_target_list(row[34]) for row in wks]
 
         # Validate Targets Syntax
-        validate_target_format(33, "Direct", report_dict, title_count)
-        validate_target_format(34, "Indirect", report_dict, title_count)
+        validate_target_format(33, direct_targets, "Direct", report_writer, title_count)
+        validate_target_format(34, indirect_targets, "Indirect", report_writer, title_count)
 
         # Perform Validation Direct_Targets, Indirect_Targets column against Concept Code
-        crossvalidate_with_concept_code(33, "Direct", report_dict, title_count)
-        crossvalidate_with_concept_code(34, "Indirect", report_dict, title_count)
+        crossvalidate_with_concept_code(direct_targets, "Direct", report_writer, title_count)
+        crossvalidate_with_concept_code(indirect_targets, "Indirect", report_writer, title_count)
 
         # Missing concept codes from target sheet
-        missing_concept_code_from_target_sheet(report_dict)
+        missing_concept_code_from_target_sheet(report_writer)
 
 
-    def find_similar_text(wks, args, rd, title_count):
+    def find_similar_text(wks, args, rw, title_count):
         """ Uses similarity.py module to find similar text
             * We remove all duplicates first
             * We store row location of all indicator text
-            * We apply NLP similarity on deduped list
-            * In fast mode, we use sorted list and start comparing from the location
-              of the first string.
-            * In deep mode, we search every sentence with other
+            * We compute similarity of all deduped pairs at once with a
+              single TF-IDF matrix product (see similarity.similar_pairs)
         """
         col = utils.get_column(wks, 5)
-        qacol = utils.get_column(wks, 10)
+        # Per row: does column "Indicator QA Status" mark it as reviewed
+        qa_done = [x in QA_REVIEWED_STATUS for x in utils.get_column(wks, 10)]
         col_line_dict = defaultdict(list)
-        for n,x in enumerate(col):
-            col_line_dict[x].append(n+1+title_count)
+        # Sheet row numbers start after the title rows
+        for rownum, x in enumerate(col, 1 + title_count):
+            col_line_dict[x].append(rownum)
 
-        colunique = list(set(col))
-        colunique.sort()
+        # Distinct non-empty values in sheet order; empty cells are never
+        # similarity candidates
+        colunique = [x for x in col_line_dict if x != '']
 
-        all_similar_lines = []
         header_written = False
 
-        for n1, val1 in enumerate(colunique):
-            if val1 == '':
+        for n1, n2, similar_val in similarity.similar_pairs(colunique, 0.7, workers=args.jobs):
+            val1 = colunique[n1]
+            val2 = colunique[n2]
+            rows1 = col_line_dict[val1]
+            rows2 = col_line_dict[val2]
+
+            # Filter by column "Indicator QA Status". If every row of both values
+            # has a status, skip the pair. If --all-similar is set, do not filter
+            if not args.all_similar and all(qa_done[x-1-title_count] for x in rows1 + rows2):
                 continue
-            for n2, val2 in enumerate(colunique[n1:]):
-                if val2 == '':
-                    continue
-                if val1 == val2:
-                    continue
-                similar_val = similarity.cosine_sim(val1, val2)
-                if similar_val > 0.7:
-                    similar_lines = [col_line_dict[val1], val1, col_line_dict[val2], val2]
-
-                    # Filter by column "Indicator QA Status". If a value exists remove it from
-                    # the list
-
-                    qacoltest = []
-                    qacoltest.extend(col_line_dict[val1])
-                    qacoltest.extend(col_line_dict[val2])
-                    #for x in qacoltest:
-                    #    print(qacol[x-1-title_count])
-                    allqacol_filled = all([qacol[x-1-title_count] in ('Complete', 'Needs Review') for x in qacoltest])
-                    #print(allqacol_filled)
-
-                    # If this flag is set, do not filter by QA column
-                    if args.all_similar:
-                        allqacol_filled = False
-
-                    if not(allqacol_filled):
-                        all_similar_lines.append(similar_lines)
-                        #print(qacoltest)
-                        #print("ZZZZ===")
-                        #print(similar_lines)
-                        #print("=====ZZZZ")
-
-                    if len(all_similar_lines) > 0 and not header_written:
-                        rd["sheet"].write(rd["row"], 0, "Test for similar indicators values")
-                        rd["sheet"].write(rd["row"], 1, "Failed", rd["red"])
-                        rd["row"]+=1
-                        rd["sheet"].write(rd["row"], 0, None)
-                        rd["row"]+=1
-                        rd["sheet"].write_row(rd["row"], 0, tuple(["Rows 1", "Similar Text 1",
-                                        "Rows 2", "Similar Text 2", "Similarity Score"]), rd["bold"])
-                        rd["row"]+=1
-                        header_written = True
-                    if not(allqacol_filled):
-                        rd["sheet"].write_row(rd["row"], 0, tuple([
-                                ','.join((str(s) for s in similar_lines[0])), "'{}'".format(similar_lines[1]),
-                                ','.join((str(s) for s in similar_lines[2])), "'{}'".format(similar_lines[3]),
-                                '{:.3f}'.format(similar_val)]))
-                        rd["row"]+=1
-
-                        print("\n Row: {}\n'{}'\n----\n Row: {}\n'{}'\nSimilarity Score = {:.3f}\n\n\n ====".format(
-                            similar_lines[0], similar_lines[1],
-                            similar_lines[2], similar_lines[3], similar_val))
-                else:
-                    if not args.deeply_similar:
-                        break
-
-                if len(all_similar_lines) == 0:
-                    print("\n\n Test for similar indicators values: Passed. Good Job!")
-                    rd["sheet"].write(rd["row"], 0, "Test for similar indicators values")
-                    rd["sheet"].write(rd["row"], 1, "Passed. Good Job!", rd["green"])
-                    rd["row"]+=1
-
-
-    def validate_sdg_compass_indicators_sheet(wks, report, title_count):
+
+            if not header_written:
+                rw.status("Test for similar indicators values", False)
+                rw.blank()
+                rw.header(["Rows 1", "Similar Text 1", "Rows 2", "Similar Text 2", "Similarity Score"])
+                header_written = True
+
+            rw.add_row([
+                    ','.join((str(s) for s in rows1)), "'{}'".format(val1),
+                    ','.join((str(s) for s in rows2)), "'{}'".format(val2),
+                    '{:.3f}'.format(similar_val)])
+
+            print("\n Row: {}\n'{}'\n----\n Row: {}\n'{}'\nSimilarity Score = {:.3f}\n\n\n ====".format(
+                rows1, val1, rows2, val2, similar_val))
+
+        if not header_written:
+            print("\n\n Test for similar indicators values: Passed. Good Job!")
+            rw.status("Test for similar indicators values", True)
+
+
+    def validate_sdg_compass_indicators_sheet(wks, title_count):
         """Perform validate on 'SDG Compass Indicator sheet
            * Finds duplicate SDG Goals
            * Finds duplicate SDG Target
         """
 
-        def finddups(colnumber, categoryname, rd, title_count):
+        def finddups(colnumber, categoryname, rw, title_count):
 
             mismatches = utils.finddups(wks, colnumber)
+            test_name = "Test for duplicate values for {} found".format(categoryname)
 
             if len(mismatches) > 0:
-                print("\n\n Test for duplicate values for {} found: Failed".format(categoryname))
+                print("\n\n {}: Failed".format(test_name))
                 print("\n ------------")
                 print("\n {} ID -> list of (Mismatched Values, Mismatched Rows)".format(categoryname))
                 print("\n ------------")
@@ -371,120 +303,62 @@ def validate(worksheets, args, report, ignore_title_count):
                     for j in mismatches[k]:
                         j[1] += title_count
                 pprint.pprint(mismatches)
-                rd["sheet"].write(rd["row"], 0, "Test for duplicate values for {} found".format(categoryname))
-                rd["sheet"].write(rd["row"], 1, "Failed", rd["red"])
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
-                rd["sheet"].write_row(rd["row"], 0, tuple(["{} ID".format(categoryname), "Mismatched Value", "Mismatched Row Number"]), rd["bold"])
-                rd["row"]+=1
-                for k in mismatches:
-                    for j in mismatches[k]:
-                        rd["sheet"].write_row(rd["row"], 0, tuple([k, "'{}'".format(j[0]), j[1]]))
-                        rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
-                rd["sheet"].write(rd["row"], 0, None)
-                rd["row"]+=1
+                rw.status(test_name, False)
+                rw.blank()
+                rw.header(["{} ID".format(categoryname), "Mismatched Value", "Mismatched Row Number"])
+                quoted = "'{}'".format
+                rw.add_rows([[k, quoted(val), row] for k, values in mismatches.items() for val, row in values])
+                rw.blank(2)
             else:
-                print("\n\n Test for duplicate values for {} found: Passed. Good Job!".format(categoryname))
-                rd["sheet"].write(rd["row"], 0, "Test for duplicate values for {} found".format(categoryname))
-                rd["sheet"].write(rd["row"], 1, "Passed. Good Job!", rd["green"])
-                rd["row"]+=1
+                print("\n\n {}: Passed. Good Job!".format(test_name))
+                rw.status(test_name, True)
 
 
         # Create Reporting worksheet
-        rwks = report.add_worksheet("SDG Compass Indicators")
-        bold = report.add_format({'bold': True})
-        bg_green = report.add_format({'bold': True, 'bg_color': "#c5eac6"})
-        bg_red = report.add_format({'bold': True, 'bg_color': "#efc6c6"})
-        report_dict = {"sheet": rwks, "row": 3, "bold": bold, "green": bg_green, "red": bg_red}
-        report_dict["sheet"].write(0, 0, "Test Status")
-        report_dict["sheet"].write(1, 0, None)
-        report_dict["sheet"].write(2, 0, None)
+        report_writer = new_report_sheet("SDG Compass Indicators", "Test Status")
 
         # Perform Validation
-        finddups(1, "SDG Goal", report_dict, title_count)
-        finddups(2, "SDG Target", report_dict, title_count)
+        finddups(1, "SDG Goal", report_writer, title_count)
+        finddups(2, "SDG Target", report_writer, title_count)
 
         # Perform similarity checks for Indicator column
         print('\n\n{0:-^60}\n'.format('Finding similar Indicator value candidates'))
-        find_similar_text(wks, args, report_dict, title_count)
+        find_similar_text(wks, args, report_writer, title_count)
 
 
-    def validate_sdg_target(wks, report, title_count):
+    def validate_sdg_target(wks, title_count):
 
         # Create Reporting worksheet
-        rwks = report.add_worksheet("SDG Targets")
-        bold = report.add_format({'bold': True})
-        bg_green = report.add_format({'bold': True, 'bg_color': "#c5eac6"})
-        bg_red = report.add_format({'bold': True, 'bg_color': "#efc6c6"})
-        report_dict = {"sheet": rwks, "row": 3, "bold": bold, "green": bg_green, "red": bg_red}
-        report_dict["sheet"].write(0, 0, "Test Status")
-        report_dict["sheet"].write(1, 0, None)
-        report_dict["sheet"].write(2, 0, None)
+        report_writer = new_report_sheet("SDG Targets", "Test Status")
 
         # Perform Validation
-        utils.build_finddups_report(wks, 1, "SDG Goals", report_dict, title_count)
-        utils.build_finddups_report(wks, 2, "SDG Target", report_dict, title_count)
+        utils.build_finddups_report(wks, 1, "SDG Goals", report_writer, title_count)
+        utils.build_finddups_report(wks, 2, "SDG Target", report_writer, title_count)
 
 
-    def build_business_to_indicator_map(wks, report, title_count):
+    def build_business_to_indicator_map(wks, title_count):
 
         # Create Reporting worksheet
-        rwks = report.add_worksheet("Business Theme Mapping")
-        bold = report.add_format({'bold': True})
-        bg_green = report.add_format({'bold': True, 'bg_color': "#c5eac6"})
-        bg_red = report.add_format({'bold': True, 'bg_color': "#efc6c6"})
-        rd = {"sheet": rwks, "row": 3, "bold": bold, "green": bg_green, "red": bg_red}
-        rd["sheet"].write(0, 0, "Mapping of Business Themes to CESR Indicator, SDG Targets")
-        rd["sheet"].write(1, 0, None)
-        rd["sheet"].write(2, 0, None)
-
-        business_theme_map = {}
-
-        for n, row in enumerate(wks):
-            theme = row[4]
-            cesr_indicator = row[5]
-            target = row[2]
-
-            if theme in business_theme_map:
-                if cesr_indicator in business_theme_map[theme]:
-                    business_theme_map[theme][cesr_indicator].add(target)
-                else:
-                    business_theme_map[theme][cesr_indicator] = {target}
-            else:
-                business_theme_map[theme] = {}
-                business_theme_map[theme][cesr_indicator] = {target}
-
-
-        rd["sheet"].write_row(rd["row"], 0, tuple(["Business Theme", "CESR Indicator", "SDG Target"]), rd["bold"])
-        rd["row"]+=1
-        sorttheme_map = OrderedDict(sorted(business_theme_map.items(), key=lambda t: t[0]))
-        for theme in sorttheme_map:
-            for indicator in business_theme_map[theme]:
-                targets = list(business_theme_map[theme][indicator])
-                targets.sort()
-                for val in targets:
-                    rd["sheet"].write_row(rd["row"], 0, tuple(["{}".format(theme), "{}".format(indicator), "{}".format(val)]))
-                    rd["row"]+=1
-        rd["sheet"].write(rd["row"], 0, None)
-        rd["row"]+=1
-        rd["sheet"].write(rd["row"], 0, None)
-        rd["row"]+=1
-
-    def unmapped_indicators_map(wks_indicator, title_count, wks_mapping, title_count2, report):
+        rw = new_report_sheet("Business Theme Mapping", "Mapping of Business Themes to CESR Indicator, SDG Targets")
+
+        # (Business Theme, CESR Indicator) -> set of SDG Targets
+        business_theme_map = defaultdict(set)
+
+        for row in wks:
+            business_theme_map[(row[4], row[5])].add(row[2])
+
+
+        rw.header(["Business Theme", "CESR Indicator", "SDG Target"])
+        rw.add_rows(["{}".format(theme), "{}".format(indicator), "{}".format(val)]
+                    for theme, indicator in sorted(business_theme_map)
+                    for val in sorted(business_theme_map[(theme, indicator)]))
+        rw.blank(2)
+
+    def unmapped_indicators_map(wks_indicator, title_count, wks_mapping, title_count2):
 
         import pdb
         # Create Reporting worksheet
-        rwks = report.add_worksheet("Unmapped Indicators")
-        bold = report.add_format({'bold': True})
-        bg_green = report.add_format({'bold': True, 'bg_color': "#c5eac6"})
-        bg_red = report.add_format({'bold': True, 'bg_color': "#efc6c6"})
-        rd = {"sheet": rwks, "row": 3, "bold": bold, "green": bg_green, "red": bg_red}
-        rd["sheet"].write(0, 0, "Unmapped Indicators", rd["bold"])
-        rd["sheet"].write(1, 0, None)
-        rd["sheet"].write(2, 0, None)
+        rw = new_report_sheet("Unmapped Indicators", "Unmapped Indicators", bold)
 
         # Build Mapping (Indicator -> BIA)
         # BIA_to_SDG: Look at column AM onwards
@@ -510,50 +384,36 @@ def validate(worksheets, args, report, ignore_title_count):
         print(ind_list)
         print("length = {}".format(len(ind_set)))
 
-        rd["sheet"].write_row(rd["row"], 0, tuple(["Row ID","SDG Goal","SDG Target","Business Theme","CESR-edited Business Theme",
-                "CESR INDICATOR DESCRIPTION","Type of Indicator","Indicator Source", "UN Indicator Description","Indicator ID", "Date", "Indicator Usefulness Status"]), rd["bold"])
-        rd["row"]+=1
-
-        for rowid in ind_list:
-            rowcols = ind_dict[rowid]
-            rowline = ["{}".format(col) for n, col in enumerate(rowcols) if n < 12]
-            rd["sheet"].write_row(rd["row"], 0, tuple(rowline))
-            rd["row"] += 1
-
-    # Build source dictionary for Targets and
-    worksheet_name = "BIA to SDG mapping"
-    wks = worksheets[worksheet_name]
-    wks_target_mapping = worksheets["BIA to SDG Target Mapping"]
-    title_count = ignore_title_count[worksheet_name]
-    print('\n\n{0:-^60}\n'.format('Validate worksheet: {}'.format(worksheet_name)))
-    validate_bia_sdg_mapping_sheet(wks, report, title_count, wks_target_mapping)
-
-    worksheet_name = "SDG Compass Indicators"
-    print('\n\n{0:-^60}\n'.format('Validate worksheet: {}'.format(worksheet_name)))
-    wks = worksheets[worksheet_name]
-    title_count = ignore_title_count[worksheet_name]
-    validate_sdg_compass_indicators_sheet(wks, report, title_count)
-
-    worksheet_name = "SDG Targets"
-    print('\n\n{0:-^60}\n'.format('Validate worksheet: {}'.format(worksheet_name)))
-    wks = worksheets[worksheet_name]
-    title_count = ignore_title_count[worksheet_name]
-    validate_sdg_target(wks, report, title_count)
-
-
-    worksheet_name = "SDG Compass Indicators"
-    print('\n\n{0:-^60}\n'.format('Build Business Theme -> (Indicator, Target) Map in worksheet: {}'.format(worksheet_name)))
-    wks = worksheets[worksheet_name]
-    title_count = ignore_title_count[worksheet_name]
-    build_business_to_indicator_map(wks, report, title_count)
-
-    worksheet_name = "SDG Compass Indicators"
-    print('\n\n{0:-^60}\n'.format('Build Unmapped Indicators Map in worksheet: {}'.format(worksheet_name)))
-    wks = worksheets[worksheet_name]
-    title_count = ignore_title_count[worksheet_name]
-    wks2 = worksheets["BIA to SDG mapping"]
-    title_count_2 = ignore_title_count["BIA to SDG mapping"]
-    unmapped_indicators_map(wks, title_count, wks2, title_count_2, report)
+        rw.header(["Row ID","SDG Goal","SDG Target","Business Theme","CESR-edited Business Theme",
+                "CESR INDICATOR DESCRIPTION","Type of Indicator","Indicator Source", "UN Indicator Description","Indicator ID", "Date", "Indicator Usefulness Status"])
+
+        rw.add_rows(["{}".format(col) for col in ind_dict[rowid][:12]] for rowid in ind_list)
+
+    # Look up each worksheet and its title row count once
+    mapping_name = "BIA to SDG mapping"
+    mapping_wks = worksheets[mapping_name]
+    mapping_title_count = ignore_title_count[mapping_name]
+    indicators_name = "SDG Compass Indicators"
+    indicators_wks = worksheets[indicators_name]
+    indicators_title_count = ignore_title_count[indicators_name]
+    targets_name = "SDG Targets"
+    targets_wks = worksheets[targets_name]
+    targets_title_count = ignore_title_count[targets_name]
+
+    print('\n\n{0:-^60}\n'.format('Validate worksheet: {}'.format(mapping_name)))
+    validate_bia_sdg_mapping_sheet(mapping_wks, mapping_title_count, worksheets["BIA to SDG Target Mapping"])
+
+    print('\n\n{0:-^60}\n'.format('Validate worksheet: {}'.format(indicators_name)))
+    validate_sdg_compass_indicators_sheet(indicators_wks, indicators_title_count)
+
+    print('\n\n{0:-^60}\n'.format('Validate worksheet: {}'.format(targets_name)))
+    validate_sdg_target(targets_wks, targets_title_count)
+
+    print('\n\n{0:-^60}\n'.format('Build Business Theme -> (Indicator, Target) Map in worksheet: {}'.format(indicators_name)))
+    build_business_to_indicator_map(indicators_wks, indicators_title_count)
+
+    print('\n\n{0:-^60}\n'.format('Build Unmapped Indicators Map in worksheet: {}'.format(indicators_name)))
+    unmapped_indicators_map(indicators_wks, indicators_title_count, mapping_wks, mapping_title_count)
 
 
 def unmap(livesheet, worksheets, title_report_count):
@@ -617,51 +477,112 @@ def sync(writesheet, worksheets, title_count, direct_column):
         target_map = {}
         wks = worksheets["SDG Targets"]
 
-        target_col = utils.get_column(wks, 2)
-        for cell in target_col:
-            strsplit = cell.split()
-            target_map[strsplit[0].strip()] = cell
+        # Key each target cell by its leading ID; split stops after the
+        # first token rather than tokenizing the whole description
+        for cell in utils.get_column(wks, 2):
+            target_map[cell.split(None, 1)[0]] = cell
 
         return target_map
 
     def sync_table(target_map):
 
-        update_cells = []
-        target_text_map = build_target_map()
         colnumber = 33 #if direct_column else 34
         valid_target_dict = utils.get_valid_target_map(worksheets["BIA to SDG mapping"], colnumber)
-        write_row_num = title_count
+
+        rows = []
         for row in worksheets["BIA to SDG Target Mapping"]:
+            targets = valid_target_dict.get(row[0], [])
+            rows.append([target_map[t] for t in targets])
 
-            writetarget = row[0]
+        if not rows:
+            return
 
-            targets = []
-            if writetarget in valid_target_dict:
-                targets = valid_target_dict[writetarget]
-            padding = [''] * (20 - len(targets))
-            targets.extend(padding)
+        # The 20 target columns L:AE are written as one rectangle; blank
+        # cells clear targets left over from an earlier sync
+        width = 20
+        first_row = title_count + 1
+        a1 = gspread.utils.rowcol_to_a1
+        updates = [{'range': "{}:{}".format(a1(first_row, 12), a1(first_row + len(rows) - 1, 12 + width - 1)),
+                    'values': [r[:width] + [''] * (width - len(r)) for r in rows]}]
 
-            write_row_num += 1
+        # Rows with more than 20 targets get their own range for the
+        # overflow, so columns past AE are only touched on those rows
+        for n, r in enumerate(rows):
+            if len(r) > width:
+                updates.append({'range': "{}:{}".format(a1(first_row + n, 12 + width), a1(first_row + n, 12 + len(r) - 1)),
+                                'values': [r[width:]]})
 
-            for n in range(len(targets)):
+        # Update all cells in a single batch write
+        writesheet.batch_update(updates, value_input_option='RAW')
 
-                if targets[n] == '':
-                    update_cells.append(gspread.Cell(write_row_num, 12 + n, ''))
-                else:
-                    update_cells.append(gspread.Cell(write_row_num, 12 + n, target_text_map[targets[n]]))
 
-        # Update all cells
-        writesheet.update_cells(update_cells)
+    sync_table(build_target_map())
 
 
-    tmap = build_target_map()
-    sync_table(tmap)
+def call_with_retry(func, *args, retries=5):
+    """Call a Google API function, retrying with exponential backoff
+       while Google rejects the request for exceeding the rate limit (HTTP 429)
+    """
+    for attempt in range(retries):
+        try:
+            return func(*args)
+        except gspread.exceptions.APIError as ex:
+            if attempt == retries - 1 or ex.response.status_code != 429:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def spreadsheet_revision(sheet):
+    """Drive modifiedTime of the spreadsheet, used to key the worksheet cache
+       gspread 5.12+ deprecates the lastUpdateTime property in favour of
+       get_lastUpdateTime(); gspread before 4.0 has neither, so return None
+    """
+    if hasattr(sheet, "get_lastUpdateTime"):
+        return sheet.get_lastUpdateTime()
+    return getattr(sheet, "lastUpdateTime", None)
 
 
-def download_and_remove_title(sheet):
+def load_worksheet_cache(cache_file):
+    """Return cached worksheet dict, or None if there is no usable cache file
+       A truncated or corrupt file counts as a miss (gzip.BadGzipFile is an OSError)
+    """
+    try:
+        with gzip.open(cache_file, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def save_worksheet_cache(cache_file, sheet_id, worksheet_dict):
+    """Write worksheet dict to cache_file, then remove cache files of older
+       revisions of the same spreadsheet
+       The data is written to a temporary file and renamed into place, so an
+       interrupted run never leaves a partial cache file behind
+    """
+    cache_dir = os.path.dirname(cache_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            pickle.dump(worksheet_dict, f)
+        os.replace(tmp_file, cache_file)
+    except:
+        os.remove(tmp_file)
+        raise
+
+    for old_file in glob.glob(os.path.join(cache_dir, glob.escape(sheet_id) + "-*.pkl.gz")):
+        if old_file != cache_file:
+            try:
+                os.remove(old_file)
+            except OSError:
+                pass
+
+
+def download_and_remove_title(sheet, refresh=False):
     """
         Download entire worksheets data so we minimize calls to Google API
         This is to prevent getting dinged from Google for excessive API usage
+        If refresh is set, ignore any cached copy and download again
     """
     # Setup how many rows are occupied by title
     # For processing, we igore these rows
@@ -673,14 +594,41 @@ def download_and_remove_title(sheet):
     wks_ignore_title_count["SDG Compass Indicators"] = 1
     wks_ignore_title_count["Unmapped Indicators"] = 3
 
+    # Downloaded data is cached on disk per spreadsheet revision, so a
+    # re-run against an unchanged spreadsheet costs one metadata request.
+    # Without a revision there is no safe cache key, so always download
+    revision = spreadsheet_revision(sheet)
+    cache_file = None
+    if revision is not None:
+        cache_file = os.path.join(os.path.expanduser(CACHE_DIR),
+                                  "{}-{}.pkl.gz".format(sheet.id, revision.replace(":", "-")))
+    if cache_file is not None and not refresh:
+        worksheet_dict = load_worksheet_cache(cache_file)
+        if worksheet_dict is not None:
+            return worksheet_dict, wks_ignore_title_count
+
+    worksheets = sheet.worksheets()
+    if hasattr(sheet, "values_batch_get"):
+        # Fetch all worksheets in a single request; each range is a quoted sheet title
+        ranges = ["'{}'".format(wks.title.replace("'", "''")) for wks in worksheets]
+        value_ranges = call_with_retry(sheet.values_batch_get, ranges)["valueRanges"]
+        all_values = [gspread.utils.fill_gaps(vr["values"]) if "values" in vr else []
+                      for vr in value_ranges]
+    else:
+        # One request per worksheet; they are I/O bound, so overlap them
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(worksheets)))) as executor:
+            all_values = list(executor.map(lambda wks: call_with_retry(wks.get_all_values), worksheets))
+
     worksheet_dict = {}
-    for wks in sheet.worksheets():
-        wks_data = wks.get_all_values()
+    for wks, wks_data in zip(worksheets, all_values):
         if wks.title in wks_ignore_title_count:
             worksheet_dict[wks.title] = wks_data[wks_ignore_title_count[wks.title]:]
         else:
             worksheet_dict[wks.title] = wks_data
 
+    if cache_file is not None:
+        save_worksheet_cache(cache_file, sheet.id, worksheet_dict)
+
     return worksheet_dict, wks_ignore_title_count
 
 
@@ -709,7 +657,22 @@ def main():
         "--deeply-similar",
         action = "store_true",
         default = False,
-        help = "Perform exhaustive similarity search between text. Warning: Takes long time"
+        help = "Accepted for compatibility; the similarity search is now always exhaustive"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        action = "store",
+        type = int,
+        default = 1,
+        help = "Number of worker processes used for similar indicator search"
+    )
+
+    parser.add_argument(
+        "--refresh",
+        action = "store_true",
+        default = False,
+        help = "Download spreadsheets again instead of using the cached copy in '{}'".format(CACHE_DIR)
     )
 
     parser.add_argument(
@@ -723,32 +686,33 @@ def main():
 
     try:
 
-        # Initialize Google and open Spreadsheet
-        initialize_google()
+        # Open Spreadsheet
         sheet_name = "BIA V5 SDG Alignment as of 05-2018 WORKING DRAFT.xlsx"
         ssheet = open_spreadsheet(sheet_name)
 
         # Cache GoogleSheet data to avoid bumping into API limits
-        worksheet_dict, ignore_title_count = download_and_remove_title(ssheet)
+        worksheet_dict, ignore_title_count = download_and_remove_title(ssheet, args.refresh)
 
         if args.action == "validate":
             print("Using sheet: {}".format(sheet_name))
-            # Create validation report
-            validation_report = xlsxwriter.Workbook("Validation Report - {}.xlsx".format(datetime.date.today().isoformat()))
+            # Create validation report. Rows are written strictly in order, so
+            # constant_memory can flush each row to disk as soon as it is done
+            validation_report = xlsxwriter.Workbook("Validation Report - {}.xlsx".format(datetime.date.today().isoformat()),
+                                                    {'constant_memory': True, 'use_zip64': True,
+                                                     'strings_to_formulas': False, 'strings_to_urls': False})
             validate(worksheet_dict, args, validation_report, ignore_title_count)
             validation_report.close()
         elif args.action == "sync":
             print("Using sheet: {}".format(sheet_name))
             sync(ssheet.worksheet("BIA to SDG Target Mapping"), worksheet_dict, ignore_title_count["BIA to SDG Target Mapping"], True)
         elif args.action == "unmap":
-            global GOOGLE_CREDENTIALS
             report_sheet = None
             if args.live:
-                report_sheet = GOOGLE_CREDENTIALS.open_by_url("https://docs.google.com/spreadsheets/d/1Sy5rGuy-321ohe7kSWf0meFa_4zDyGurbVVOCxBhJ4E/edit#gid=403241877")
+                report_sheet = google_client().open_by_url("https://docs.google.com/spreadsheets/d/1Sy5rGuy-321ohe7kSWf0meFa_4zDyGurbVVOCxBhJ4E/edit#gid=403241877")
             else:
-                report_sheet = GOOGLE_CREDENTIALS.open_by_url("https://docs.google.com/spreadsheets/d/13K05CWTK2LaEv2TgG3KdCr1XIUjq6UNpCbG7UOOAytk")
+                report_sheet = google_client().open_by_url("https://docs.google.com/spreadsheets/d/13K05CWTK2LaEv2TgG3KdCr1XIUjq6UNpCbG7UOOAytk")
             print("Opened report sheet")
-            reportsheet_dict, ignore_report_title_count = download_and_remove_title(report_sheet)
+            reportsheet_dict, ignore_report_title_count = download_and_remove_title(report_sheet, args.refresh)
             unmap(report_sheet, reportsheet_dict, ignore_report_title_count)
             print("Finished transposing mapped/unmapped columns")
 
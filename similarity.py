@@ -3,20 +3,63 @@
 """
 
 import nltk, string
+import numpy as np
+from scipy import sparse
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 
 stemmer = nltk.stem.porter.PorterStemmer()
 remove_punctuation_map = dict((ord(char), None) for char in string.punctuation)
 
+@lru_cache(maxsize=None)
+def stem(word):
+    """Porter stem a single word, cached since vocabulary repeats across texts"""
+    return stemmer.stem(word)
+
 def stem_tokens(tokens):
-    return [stemmer.stem(item) for item in tokens]
+    return [stem(item) for item in tokens]
 
 def normalize(text):
     return stem_tokens(nltk.word_tokenize(text))
 
-vectorizer = TfidfVectorizer(tokenizer=normalize, stop_words='english')
+def _block_pairs(tfidf, offset, block_size, threshold):
+    """Similar pairs between the first block_size rows of tfidf and all
+       of its rows. offset is the index of tfidf's first row in the corpus
+    """
+    # Strictly upper triangle: drops self-similarity and mirrored pairs
+    sims = sparse.triu(tfidf[:block_size] * tfidf.T, k=1, format='coo')
+    keep = sims.data > threshold
+    return [(offset + int(i), offset + int(j), float(s))
+            for i, j, s in zip(sims.row[keep], sims.col[keep], sims.data[keep])]
 
-def cosine_sim(text1, text2):
-    tfidf = vectorizer.fit_transform([text1, text2])
-    return ((tfidf * tfidf.T).A)[0,1]
+def similar_pairs(texts, threshold, block_size=1000, workers=1):
+    """Find all pairs of texts with cosine similarity above threshold
+       TF-IDF rows are L2 normalized, so the sparse product X * X.T
+       yields pairwise cosines. Only texts sharing a stemmed term get a
+       nonzero entry, so the product already skips unrelated pairs.
+       Rows are processed in blocks against the texts from the block
+       onwards, which bounds memory and skips the lower triangle.
+       With workers > 1 blocks are scored in parallel processes.
+       Returns sorted list of (index1, index2, score) with index1 < index2
+    """
+    if len(texts) < 2:
+        return []
+    # float32 halves the bytes moved by the sparse products; scores are
+    # only compared against a threshold, so the precision is ample
+    tfidf = TfidfVectorizer(tokenizer=normalize, stop_words='english',
+                            dtype=np.float32).fit_transform(texts)
+    starts = range(0, tfidf.shape[0], block_size)
+    pairs = []
+    if workers > 1 and len(starts) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_block_pairs, tfidf[start:], start, block_size, threshold)
+                       for start in starts]
+            for future in futures:
+                pairs.extend(future.result())
+    else:
+        for start in starts:
+            pairs.extend(_block_pairs(tfidf[start:], start, block_size, threshold))
+    pairs.sort()
+    return pairs
@@ -1,80 +1,111 @@
 """Utility for SDG project"""
 
-import re
 from collections import defaultdict
+from functools import lru_cache
+from operator import itemgetter
 import pprint
+from sys import intern
+
 
 def get_column(matrix, colnumber):
     """Utility function to extract column from a matrix containing entire worksheet"""
-    return [a[colnumber] for a in matrix]
+    return list(map(itemgetter(colnumber), matrix))
 
-def build_target_list(colval):
-    """Generates a list of targets from a cell"""
+def get_column_set(matrix, colnumber):
+    """Utility function to extract the distinct values of a column"""
+    return set(map(itemgetter(colnumber), matrix))
 
-    nonempty = (a.strip() for a in colval.splitlines() if a.strip() != '')
-    tlist = [a for a in nonempty if not(a[0].isalpha() or a[0] == '?')]
-    tlist.sort()
-    return tlist
+@lru_cache(maxsize=None)
+def parse_targets(colval):
+    """Tuple of targets in a cell in the order written, cached on the cell
+       text since the same Direct/Indirect Target cells are parsed by several checks
+    """
+    if not colval or colval.isspace():
+        return ()
+    return tuple(a for a in (line.strip() for line in colval.splitlines())
+                 if a and not(a[0].isalpha() or a[0] == '?'))
+
+def build_target_list(colval):
+    """Generates a list of targets from a cell, in the order written"""
+    return list(parse_targets(colval))
 
-def get_target_list(worksheet, row, col):
-    colval = worksheet[row][col]
-    return build_target_list(colval)
+def build_target_list_sorted(colval):
+    """Generates a sorted list of targets from a cell, for callers that
+       compare or write out target lists
+    """
+    return sorted(parse_targets(colval))
 
-def validate_target_format(wks, colnumber):
+def valid_target(target):
+    """Checks target syntax: digit.digit or digit.alpha, e.g. '1.2' or '10.a'
+       One or two digits, a dot, then one or two digits or a lowercase letter
+    """
+    goal, dot, sub = target.partition(".")
+    if not (dot and 0 < len(goal) <= 2 and goal.isdecimal()):
+        return False
+    if len(sub) == 1 and "a" <= sub <= "z":
+        return True
+    return 0 < len(sub) <= 2 and all("0" <= c <= "9" for c in sub)
+
+def validate_target_format(wks, colnumber, target_lists=None):
     """Helper function to validate the syntax of a target specified in
         Direct or Indirect Target column
         The format should be like digit.digit or digit.alpha
+        target_lists optionally holds the already parsed target list per row
     """
-    syntax = re.compile("^\d{1,2}\.([0-9]{1,2}|[a-z])$")
+    if target_lists is None:
+        target_lists = [build_target_list(row[colnumber]) for row in wks]
+
     mismatches = defaultdict(list)
 
-    for n,x in enumerate(wks):
-        target_list = get_target_list(wks, n, colnumber)
-        invalid_list = [a for a in target_list if syntax.match(a) is None]
+    for n, target_list in enumerate(target_lists):
+        invalid_list = [a for a in target_list if not valid_target(a)]
         if len(invalid_list) > 0:
             mismatches[n+1].extend(invalid_list)
 
     return mismatches
 
-def get_valid_target_map(wks, colnumber):
+def get_valid_target_map(wks, colnumber, target_lists=None):
+    """Concept code -> valid targets of the first row carrying that code
+        target_lists optionally holds the already parsed target list per row,
+        otherwise each cell is parsed sorted so the map has a stable order
+    """
+    if target_lists is None:
+        target_lists = [build_target_list_sorted(row[colnumber]) for row in wks]
 
-    syntax = re.compile("^\d{1,2}\.([0-9]{1,2}|[a-z])$")
     valid_target_map = {}
 
-    for n,x in enumerate(wks):
-        target_list = get_target_list(wks, n, colnumber)
-        valid_list = [a for a in target_list if syntax.match(a) is not None]
-        if wks[n][0] not in valid_target_map:
-            valid_target_map[wks[n][0]] = valid_list
+    for row, target_list in zip(wks, target_lists):
+        if row[0] not in valid_target_map:
+            valid_target_map[row[0]] = [a for a in target_list if valid_target(a)]
 
     return valid_target_map
 
 
-def finddups(wks, colnumber):
+def concept_id(value):
+    """Leading ID of a cell such as '1.2. Some text' -> '1.2'"""
+    x = value.split(None, 1)[0]
+    return x[:-1] if x[-1] == "." else x
 
-    unique_dict = defaultdict(set)
-    mismatches = defaultdict(list)
 
-    for n, item in enumerate(wks):
-        # Ignore first line since it is title
-        x = item[colnumber].split()[0]
-        cid = x[:-1] if x[-1] == "." else x
-        if item[colnumber] not in unique_dict[cid]:
-            mismatches[cid].append([item[colnumber], n+1])
-        unique_dict[cid].add(item[colnumber])
+def finddups(wks, colnumber):
 
-    remove = [item for item in mismatches if len(mismatches[item]) > 1]
-    mismatches = { k:mismatches[k] for k in mismatches if k in remove}
+    # ID -> {distinct value: row of its first occurrence}
+    seen = defaultdict(dict)
 
-    return mismatches
+    for n, val in enumerate(map(itemgetter(colnumber), wks)):
+        seen[intern(concept_id(val))].setdefault(val, n+1)
 
+    return {cid: [[val, row] for val, row in values.items()]
+            for cid, values in seen.items() if len(values) > 1}
 
-def build_finddups_report(wks, colnumber, categoryname, rd, title_count):
+
+def build_finddups_report(wks, colnumber, categoryname, rw, title_count):
 
     mismatches = finddups(wks, colnumber)
+    test_name = "Test for duplicate values for {} found".format(categoryname)
 
     if len(mismatches) > 0:
-        print("\n\n Test for duplicate values for {} found: Failed".format(categoryname))
+        print("\n\n {}: Failed".format(test_name))
         print("\n ------------")
         print("\n {} ID -> list of (Mismatched Values, Mismatched Rows)".format(categoryname))
         print("\n ------------")
@@ -83,23 +114,59 @@ def build_finddups_report(wks, colnumber, categoryname, rd, title_count):
             for j in mismatches[k]:
                 j[1] += title_count
         pprint.pprint(mismatches)
-        rd["sheet"].write(rd["row"], 0, "Test for duplicate values for {} found".format(categoryname))
-        rd["sheet"].write(rd["row"], 1, "Failed", rd["red"])
-        rd["row"]+=1
-        rd["sheet"].write(rd["row"], 0, None)
-        rd["row"]+=1
-        rd["sheet"].write_row(rd["row"], 0, tuple(["{} ID".format(categoryname), "Mismatched Value", "Mismatched Row Number"]), rd["bold"])
-        rd["row"]+=1
-        for k in mismatches:
-            for j in mismatches[k]:
-                rd["sheet"].write_row(rd["row"], 0, tuple([k, "'{}'".format(j[0]), j[1]]))
-                rd["row"]+=1
-        rd["sheet"].write(rd["row"], 0, None)
-        rd["row"]+=1
-        rd["sheet"].write(rd["row"], 0, None)
-        rd["row"]+=1
+        rw.status(test_name, False)
+        rw.blank()
+        rw.header(["{} ID".format(categoryname), "Mismatched Value", "Mismatched Row Number"])
+        quoted = "'{}'".format
+        rw.add_rows([[k, quoted(val), row] for k, values in mismatches.items() for val, row in values])
+        rw.blank(2)
     else:
-        print("\n\n Test for duplicate values for {} found: Passed".format(categoryname))
-        rd["sheet"].write(rd["row"], 0, "Test for duplicate values for {} found".format(categoryname))
-        rd["sheet"].write(rd["row"], 1, "Passed", rd["green"])
-        rd["row"]+=1
+        print("\n\n {}: Passed".format(test_name))
+        rw.status(test_name, True, "Passed")
+
+
+class ReportWriter(object):
+    """Writes a report worksheet top to bottom, tracking the next free row
+       Rows below the title start at row 3
+    """
+
+    def __init__(self, sheet, bold, green, red, row=3):
+        self.sheet = sheet
+        self.bold = bold
+        self.green = green
+        self.red = red
+        self.row = row
+
+    def status(self, name, passed, passed_text="Passed. Good Job!"):
+        """Write a test name followed by its Passed/Failed status cell"""
+        self.sheet.write(self.row, 0, name)
+        if passed:
+            self.sheet.write(self.row, 1, passed_text, self.green)
+        else:
+            self.sheet.write(self.row, 1, "Failed", self.red)
+        self.row += 1
+
+    def blank(self, count=1):
+        """Leave empty rows. xlsxwriter ignores unformatted blank cells,
+           so nothing needs to be written
+        """
+        self.row += count
+
+    def header(self, values):
+        """Write a row of bold column titles"""
+        self.sheet.write_row(self.row, 0, values, self.bold)
+        self.row += 1
+
+    def add_row(self, values):
+        """Write a row of values"""
+        self.sheet.write_row(self.row, 0, values)
+        self.row += 1
+
+    def add_rows(self, rows):
+        """Write consecutive rows of values"""
+        write_row = self.sheet.write_row
+        row = self.row
+        for values in rows:
+            write_row(row, 0, values)
+            row += 1
+        self.row = row